@@ -5,10 +5,16 @@ This module defines helper functions for querying multiple IP data providers.  E
 returns basic geolocation and network information for a given IP address.  The functions
 return `ProviderResult` models that encapsulate success/failure status and parsed data.
 
-When adding providers, follow this pattern:
-1. Use httpx to make an HTTP GET request with a sensible timeout (3–5 seconds).
-2. Catch exceptions and return a ProviderResult with ok=False and an error message.
-3. Normalise the response fields into the `GeoInfo` model.
+Providers are described declaratively by a `ProviderSpec` and all share one request
+path, `fetch_provider`.  When adding providers, follow this pattern:
+1. Write a mapping function that normalises the provider's JSON into `GeoInfo` field
+   values.  `GeoInfo.model_construct` runs no validation, so convert values to the
+   field types yourself; raise ValueError for error payloads.
+2. Add a `ProviderSpec` with the URL template (`{ip}` is replaced by the queried
+   address, or an empty string for the caller) and any query parameters.
+3. Register the spec in `PROVIDERS`.  Requests go through the shared
+   `httpx.AsyncClient` passed in by the caller, which owns the connection pool and
+   the default timeout; failures are reported as ok=False with an error message.
 
 If an API key or token is required, fetch it from the corresponding environment variable
 to avoid hard‑coding secrets.  See README.md for supported variables.
@@ -16,204 +22,311 @@ to avoid hard‑coding secrets.  See README.md for supported variables.
 
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
-from typing import Optional
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
 
 import httpx
+import orjson
+from cachetools import TTLCache
 from models import GeoInfo, ProviderResult
 
+logger = logging.getLogger(__name__)
 
-async def fetch_ipapi(ip: Optional[str] = None) -> ProviderResult:
-    """Query ipapi.co for geolocation data.
+# Credentials are read once at import; the process environment does not change
+# while the app is running.
+IPINFO_TOKEN = os.getenv("IPINFO_TOKEN")
+IPDATA_API_KEY = os.getenv("IPDATA_API_KEY")
+
+
+@dataclass(frozen=True, slots=True)
+class ProviderSpec:
+    """Static description of an IP data provider."""
+
+    name: str
+    url: str
+    map: Callable[[dict[str, Any]], dict[str, Any]]
+    params: Optional[dict[str, str]] = None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """Convert a coordinate to float, returning None for missing or malformed values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _map_ipapi(data: dict[str, Any]) -> dict[str, Any]:
+    """Map an ipapi.co response.
 
     ipapi.co has a generous free tier and does not require an API key for basic data.
     """
-    base_url = "https://ipapi.co"
-    provider_name = "ipapi"
-    url = f"{base_url}/{ip or ''}/json/"
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            data = resp.json()
-            geo = GeoInfo(
-                ip=data.get("ip"),
-                country=data.get("country_code") or data.get("country_name"),
-                region=data.get("region"),
-                city=data.get("city"),
-                asn=data.get("asn"),
-                as_org=data.get("org"),
-                isp=data.get("org"),  # ipapi combines org and ISP
-                latitude=float(data.get("latitude")) if data.get("latitude") else None,
-                longitude=float(data.get("longitude")) if data.get("longitude") else None,
-            )
-            return ProviderResult(provider=provider_name, ok=True, data=geo)
-        except Exception as exc:
-            return ProviderResult(provider=provider_name, ok=False, error=str(exc))
-
-
-async def fetch_ipinfo(ip: Optional[str] = None) -> ProviderResult:
-    """Query ipinfo.io for geolocation data.
+    return {
+        "ip": data.get("ip"),
+        "country": data.get("country_code") or data.get("country_name"),
+        "region": data.get("region"),
+        "city": data.get("city"),
+        "asn": data.get("asn"),
+        "as_org": data.get("org"),
+        "isp": data.get("org"),  # ipapi combines org and ISP
+        "latitude": _to_float(data.get("latitude")),
+        "longitude": _to_float(data.get("longitude")),
+    }
+
+
+def _map_ipinfo(data: dict[str, Any]) -> dict[str, Any]:
+    """Map an ipinfo.io response.
 
     Requires an API token for higher rate limits.  If `IPINFO_TOKEN` is not
     provided in the environment, the free tier is used.
     """
-    base_url = "https://ipinfo.io"
-    provider_name = "ipinfo"
-    token = os.getenv("IPINFO_TOKEN")
-    url = f"{base_url}/{ip or ''}/json"
-    params = {"token": token} if token else None
-    async with httpx.AsyncClient(timeout=5.0) as client:
+    loc = data.get("loc") or ""
+    lat, lon = None, None
+    if loc and "," in loc:
+        lat_str, lon_str = loc.split(",", 1)
         try:
-            resp = await client.get(url, params=params)
-            resp.raise_for_status()
-            data = resp.json()
-            loc = data.get("loc") or ""
+            lat, lon = float(lat_str), float(lon_str)
+        except ValueError:
             lat, lon = None, None
-            if loc and "," in loc:
-                lat_str, lon_str = loc.split(",", 1)
-                try:
-                    lat, lon = float(lat_str), float(lon_str)
-                except ValueError:
-                    lat, lon = None, None
-            geo = GeoInfo(
-                ip=data.get("ip"),
-                country=data.get("country"),
-                region=data.get("region"),
-                city=data.get("city"),
-                asn=data.get("org").split(" ")[0] if data.get("org") else None,
-                as_org=" ".join(data.get("org").split(" ")[1:]) if data.get("org") else None,
-                isp=data.get("org"),
-                latitude=lat,
-                longitude=lon,
-            )
-            return ProviderResult(provider=provider_name, ok=True, data=geo)
-        except Exception as exc:
-            return ProviderResult(provider=provider_name, ok=False, error=str(exc))
-
-
-async def fetch_ipwhois(ip: Optional[str] = None) -> ProviderResult:
-    """Query ipwho.is for geolocation data.
-
-    This provider has no API key and responds with a simple JSON structure.
+    org = data.get("org")
+    # "org" is "AS<number> <name>"; split it into its two parts.
+    asn, _, as_org = org.partition(" ") if org else (None, None, None)
+    return {
+        "ip": data.get("ip"),
+        "country": data.get("country"),
+        "region": data.get("region"),
+        "city": data.get("city"),
+        "asn": asn,
+        "as_org": as_org,
+        "isp": org,
+        "latitude": lat,
+        "longitude": lon,
+    }
+
+
+def _map_ipwhois(data: dict[str, Any]) -> dict[str, Any]:
+    """Map an ipwho.is response.
+
+    This provider has no API key.  Network details live in a nested `connection`
+    object whose `asn` is a bare integer.
     """
-    base_url = "https://ipwho.is"
-    provider_name = "ipwhois"
-    url = f"{base_url}/{ip or ''}"
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            data = resp.json()
-            if not data.get("success", True):
-                raise Exception(data.get("message", "Unknown error"))
-            geo = GeoInfo(
-                ip=data.get("ip"),
-                country=data.get("country_code") or data.get("country"),
-                region=data.get("region"),
-                city=data.get("city"),
-                asn=data.get("asn"),
-                as_org=data.get("org"),
-                isp=data.get("isp"),
-                latitude=data.get("latitude"),
-                longitude=data.get("longitude"),
-            )
-            return ProviderResult(provider=provider_name, ok=True, data=geo)
-        except Exception as exc:
-            return ProviderResult(provider=provider_name, ok=False, error=str(exc))
-
-
-async def fetch_ipapi_com(ip: Optional[str] = None) -> ProviderResult:
-    """Query ip-api.com for geolocation data.
+    if not data.get("success", True):
+        raise ValueError(data.get("message", "Unknown error"))
+    connection = data.get("connection") or {}
+    asn = connection.get("asn")
+    return {
+        "ip": data.get("ip"),
+        "country": data.get("country_code") or data.get("country"),
+        "region": data.get("region"),
+        "city": data.get("city"),
+        "asn": f"AS{asn}" if asn is not None else None,
+        "as_org": connection.get("org"),
+        "isp": connection.get("isp"),
+        "latitude": _to_float(data.get("latitude")),
+        "longitude": _to_float(data.get("longitude")),
+    }
+
+
+def _map_ipapi_com(data: dict[str, Any]) -> dict[str, Any]:
+    """Map an ip-api.com response.
 
     ip-api.com provides a free tier with limited fields but no API key required.  It
     returns 429 status if rate limited.  Note: ip-api.com does not support HTTPS on
     the free tier for all endpoints, so we use the JSON endpoint over HTTP.
     """
-    provider_name = "ip-api"
-    url = f"http://ip-api.com/json/{ip or ''}"
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            data = resp.json()
-            if data.get("status") != "success":
-                raise Exception(data.get("message", "Unknown error"))
-            geo = GeoInfo(
-                ip=data.get("query"),
-                country=data.get("countryCode") or data.get("country"),
-                region=data.get("regionName"),
-                city=data.get("city"),
-                asn=data.get("as").split(" ")[0] if data.get("as") else None,
-                as_org=" ".join(data.get("as").split(" ")[1:]) if data.get("as") else None,
-                isp=data.get("isp"),
-                latitude=data.get("lat"),
-                longitude=data.get("lon"),
-            )
-            return ProviderResult(provider=provider_name, ok=True, data=geo)
-        except Exception as exc:
-            return ProviderResult(provider=provider_name, ok=False, error=str(exc))
-
-
-async def fetch_ipdata(ip: Optional[str] = None) -> ProviderResult:
-    """Query ipdata.co for geolocation data.
-
-    ipdata.co requires an API key for most functionality.  Without a key the
-    service will respond with an error.  Set the `IPDATA_API_KEY` environment
-    variable to enable this provider.  This function will skip the provider if no key
-    is present.
+    if data.get("status") != "success":
+        raise ValueError(data.get("message", "Unknown error"))
+    as_field = data.get("as")
+    asn, _, as_org = as_field.partition(" ") if as_field else (None, None, None)
+    return {
+        "ip": data.get("query"),
+        "country": data.get("countryCode") or data.get("country"),
+        "region": data.get("regionName"),
+        "city": data.get("city"),
+        "asn": asn,
+        "as_org": as_org,
+        "isp": data.get("isp"),
+        "latitude": _to_float(data.get("lat")),
+        "longitude": _to_float(data.get("lon")),
+    }
+
+
+def _map_ipdata(data: dict[str, Any]) -> dict[str, Any]:
+    """Map an ipdata.co response.
+
+    ipdata.co requires an API key for most functionality.  Set the
+    `IPDATA_API_KEY` environment variable to enable this provider; without it the
+    provider is not queried at all.  `asn` is an object holding the AS number and
+    the organisation name.
     """
-    provider_name = "ipdata"
-    api_key = os.getenv("IPDATA_API_KEY")
-    if not api_key:
-        return ProviderResult(provider=provider_name, ok=False, error="No API key configured")
-    url = f"https://api.ipdata.co/{ip or ''}"
-    params = {"api-key": api_key}
-    async with httpx.AsyncClient(timeout=5.0) as client:
+    asn = data.get("asn") or {}
+    return {
+        "ip": data.get("ip"),
+        "country": data.get("country_code") or data.get("country_name"),
+        "region": data.get("region") or data.get("region_name"),
+        "city": data.get("city"),
+        "asn": asn.get("asn"),
+        "as_org": asn.get("name"),
+        "isp": asn.get("name"),
+        "latitude": _to_float(data.get("latitude")),
+        "longitude": _to_float(data.get("longitude")),
+    }
+
+
+# Providers queried by `fetch_providers`, resolved once at import.  Providers
+# requiring keys are skipped if the key is not present.
+PROVIDERS: tuple[ProviderSpec, ...] = (
+    ProviderSpec("ipapi", "https://ipapi.co/{ip}/json/", _map_ipapi),
+    ProviderSpec(
+        "ipinfo",
+        "https://ipinfo.io/{ip}/json",
+        _map_ipinfo,
+        params={"token": IPINFO_TOKEN} if IPINFO_TOKEN else None,
+    ),
+    ProviderSpec("ipwhois", "https://ipwho.is/{ip}", _map_ipwhois),
+    ProviderSpec("ip-api", "http://ip-api.com/json/{ip}", _map_ipapi_com),
+) + (
+    (ProviderSpec("ipdata", "https://api.ipdata.co/{ip}", _map_ipdata, params={"api-key": IPDATA_API_KEY}),)
+    if IPDATA_API_KEY
+    else ()
+)
+
+# Cap in-flight requests per provider so bursts queue here, visibly, instead of
+# stalling inside the shared client's connection pool.
+PROVIDER_CONCURRENCY = 50
+_SEMAPHORES: dict[str, asyncio.Semaphore] = {
+    spec.name: asyncio.Semaphore(PROVIDER_CONCURRENCY) for spec in PROVIDERS
+}
+
+NON_JSON_ERROR = "non-json body"
+
+
+async def fetch_provider(spec: ProviderSpec, client: httpx.AsyncClient, ip: Optional[str] = None) -> ProviderResult:
+    """Query a single provider and normalise its response into a ProviderResult."""
+    async with _SEMAPHORES[spec.name]:
         try:
-            resp = await client.get(url, params=params)
+            resp = await client.get(spec.url.format(ip=ip or ""), params=spec.params)
             resp.raise_for_status()
-            data = resp.json()
-            geo = GeoInfo(
-                ip=data.get("ip"),
-                country=data.get("country_code") or data.get("country_name"),
-                region=data.get("region") or data.get("region_name"),
-                city=data.get("city"),
-                asn=data.get("asn"),
-                as_org=data.get("organisation"),
-                isp=data.get("organisation"),
-                latitude=data.get("latitude"),
-                longitude=data.get("longitude"),
-            )
-            return ProviderResult(provider=provider_name, ok=True, data=geo)
-        except Exception as exc:
-            return ProviderResult(provider=provider_name, ok=False, error=str(exc))
-
-
-async def fetch_providers(ip: Optional[str] = None) -> list[ProviderResult]:
+            body = resp.content
+            # Some providers answer rate limits with a 200 HTML page; reject anything
+            # that cannot be JSON without going through the parser.
+            if body[:1] not in (b"{", b"["):
+                return ProviderResult.model_construct(provider=spec.name, ok=False, error=NON_JSON_ERROR)
+            data = orjson.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError(f"unexpected JSON {type(data).__name__} in response")
+            fields = spec.map(data)
+            # model_construct skips validation, so at least insist on the required field.
+            if not isinstance(fields["ip"], str):
+                raise ValueError("response has no IP address")
+            geo = GeoInfo.model_construct(**fields)
+            return ProviderResult.model_construct(provider=spec.name, ok=True, data=geo)
+        # Only the failures a provider can legitimately produce are caught here;
+        # anything else is a bug and surfaces through `fetch_providers`.
+        except (httpx.HTTPError, orjson.JSONDecodeError, ValueError, KeyError) as exc:
+            return ProviderResult.model_construct(provider=spec.name, ok=False, error=str(exc))
+
+
+# Scheduling budget for a round of provider calls.  We answer as soon as
+# MIN_RESULTS providers have succeeded, so latency tracks the faster providers
+# rather than the slowest; at the hard deadline we answer with whatever we have.
+# Providers still running at that point are cancelled and reported as failed.
+HARD_DEADLINE = 2.0
+MIN_RESULTS = 2
+DEADLINE_ERROR = "deadline"
+INTERNAL_ERROR = "internal error"
+
+
+async def fetch_providers(client: httpx.AsyncClient, ip: Optional[str] = None) -> list[ProviderResult]:
     """Collect data from all configured providers concurrently.
 
-    Returns a list of ProviderResult objects.  Providers that fail or are not
-    configured will return `ok=False` with an error message.
+    All providers share the caller's `client` so pooled connections are reused
+    across requests.  Returns a list of ProviderResult objects in provider order.
+    Providers that fail, are not configured, or miss the deadline will return
+    `ok=False` with an error message.
+    """
+    tasks = {asyncio.create_task(fetch_provider(spec, client, ip)): spec.name for spec in PROVIDERS}
+
+    loop = asyncio.get_running_loop()
+    hard = loop.time() + HARD_DEADLINE
+    results: dict[asyncio.Task, ProviderResult] = {}
+    succeeded = 0
+    pending = set(tasks)
+    try:
+        while pending:
+            timeout = hard - loop.time()
+            if timeout <= 0 or succeeded >= MIN_RESULTS:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                exc = task.exception()
+                if exc is None:
+                    res = task.result()
+                    succeeded += res.ok
+                else:
+                    # Anything `fetch_provider` does not catch is a bug: log it and
+                    # keep internal details out of the response.
+                    logger.error("provider %s failed unexpectedly", tasks[task], exc_info=exc)
+                    res = ProviderResult.model_construct(provider=tasks[task], ok=False, error=INTERNAL_ERROR)
+                results[task] = res
+    finally:
+        # Stragglers past the deadline, or every task if we were cancelled, must
+        # not keep running and holding provider semaphore slots.
+        for task in pending:
+            task.cancel()
+
+    for task in pending:
+        results[task] = ProviderResult.model_construct(provider=tasks[task], ok=False, error=DEADLINE_ERROR)
+    return [results[task] for task in tasks]
+
+
+# Geolocation for a given IP is stable, so provider results are cached in-process
+# for an hour.  Rounds where a provider missed the deadline are kept only briefly,
+# so a persistently slow upstream still gets retried without defeating the cache.
+# Concurrent lookups for the same IP share the in-flight round of provider calls
+# instead of stampeding the upstreams.
+_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+_PARTIAL_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+_INFLIGHT: dict[str, asyncio.Task] = {}
+
+
+async def _fetch_and_cache(client: httpx.AsyncClient, ip: Optional[str], key: str) -> list[ProviderResult]:
+    """Run one round of provider calls for `key` and cache it if it is worth keeping."""
+    try:
+        results = await fetch_providers(client, ip)
+        if any(res.ok for res in results):
+            if any(res.error == DEADLINE_ERROR for res in results):
+                _PARTIAL_CACHE[key] = results
+            else:
+                _CACHE[key] = results
+        return results
+    finally:
+        del _INFLIGHT[key]
+
+
+async def fetch_providers_cached(
+    client: httpx.AsyncClient, ip: Optional[str] = None
+) -> tuple[list[ProviderResult], bool]:
+    """Return provider results for `ip`, served from the TTL cache when possible.
+
+    Returns a `(results, hit)` tuple where `hit` tells whether the cache was used.
+    Callers arriving while a lookup for the same IP is running await that lookup
+    rather than starting their own.  Results without any successful provider are
+    not cached, so transient outages are retried on the next request; results with
+    deadline misses are cached for a minute only.
     """
-    # Compose the coroutines for providers that should run.  Skip providers
-    # requiring keys if the key is not present.
-    tasks = [
-        fetch_ipapi(ip),
-        fetch_ipinfo(ip),
-        fetch_ipwhois(ip),
-        fetch_ipapi_com(ip),
-    ]
-    # Add ipdata provider only if key is set
-    if os.getenv("IPDATA_API_KEY"):
-        tasks.append(fetch_ipdata(ip))
-    import asyncio
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    normalized: list[ProviderResult] = []
-    for res in results:
-        if isinstance(res, ProviderResult):
-            normalized.append(res)
-        else:
-            # Unexpected exceptions are recorded as generic errors
-            normalized.append(ProviderResult(provider="unknown", ok=False, error=str(res)))
-    return normalized
+    key = ip or ""
+    cached = _CACHE.get(key)
+    if cached is None:
+        cached = _PARTIAL_CACHE.get(key)
+    if cached is not None:
+        return cached, True
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_and_cache(client, ip, key))
+        _INFLIGHT[key] = task
+    # Shield the shared round so one disconnecting caller does not cancel it for all.
+    return await asyncio.shield(task), False
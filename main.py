@@ -10,23 +10,83 @@ in parallel and returns normalised responses.
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
 
 import httpx
-from fastapi import FastAPI, Request
+import orjson
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from models import LocalIPResponse, IPIntelResponse, IPIntelRequest, ProviderResult, RequestMetaResponse
-from ip_providers import fetch_providers
+from models import MAX_IP_LENGTH, LocalIPResponse, IPIntelResponse, IPIntelRequest, RequestMetaResponse
+from ip_providers import PROVIDER_CONCURRENCY, PROVIDERS, fetch_providers_cached
 
+try:
+    # uvloop is installed with uvicorn[standard] on non-Windows platforms.  Setting
+    # the policy here also covers ASGI servers that do not pick a loop themselves.
+    import uvloop
+except ImportError:  # pragma: no cover - platform dependent
+    uvloop = None
+else:
+    uvloop.install()
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 
-app = FastAPI(title="IP Network Toolbox MVP", docs_url="/docs", redoc_url="/redoc")
+# HTML pages served from memory, keyed by file name under STATIC_DIR.
+PAGES = ("whoami.html", "index.html", "ip_intel.html", "webrtc.html")
+PAGE_CACHE_CONTROL = "public, max-age=300"
+
+# Outbound pool: one slot per provider semaphore permit, plus headroom for the
+# ipify lookups, which share the client but are not semaphore-bound.
+IPIFY_CONNECTIONS = 20
+MAX_OUTBOUND_CONNECTIONS = len(PROVIDERS) * PROVIDER_CONCURRENCY + IPIFY_CONNECTIONS
+
+
+def load_pages() -> dict[str, tuple[bytes, str]]:
+    """Read the HTML pages once and pair each body with a quoted ETag."""
+    pages = {}
+    for name in PAGES:
+        data = (STATIC_DIR / name).read_bytes()
+        pages[name] = (data, f'"{hashlib.blake2b(data, digest_size=8).hexdigest()}"')
+    return pages
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared outbound HTTP client for the lifetime of the application.
+
+    Reusing one pooled client keeps TCP/TLS connections to the providers alive
+    between requests instead of renegotiating them on every call.  The HTML
+    pages are also loaded into memory here.
+    """
+    app.state.pages = load_pages()
+    # No explicit transport is passed, so httpx keeps applying the standard proxy
+    # environment variables (HTTP(S)_PROXY, ALL_PROXY, NO_PROXY) per URL.
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=5.0,
+        # Idle connections are kept for 30s so provider hosts are rarely re-resolved.
+        limits=httpx.Limits(
+            max_connections=MAX_OUTBOUND_CONNECTIONS, max_keepalive_connections=50, keepalive_expiry=30.0
+        ),
+    ) as client:
+        app.state.client = client
+        yield
+
+
+app = FastAPI(
+    title="IP Network Toolbox MVP",
+    docs_url="/docs",
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # CORS configuration – adjust `allow_origins` to suit your deployment needs.
 app.add_middleware(
@@ -41,96 +101,141 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against `etag` using weak comparison (RFC 9110)."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def page_response(request: Request, name: str) -> Response:
+    """Serve a preloaded HTML page, answering 304 when the client's copy is current."""
+    data, etag = request.app.state.pages[name]
+    headers = {"ETag": etag, "Cache-Control": PAGE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="text/html", headers=headers)
+
+
 @app.get("/", include_in_schema=False)
-async def root() -> FileResponse:
+async def root(request: Request) -> Response:
     """Serve a compact IP diagnostics page similar to ip.skk.moe."""
-    index_path = STATIC_DIR / "whoami.html"
-    return FileResponse(index_path)
+    return page_response(request, "whoami.html")
 
 
 @app.get("/toolbox", include_in_schema=False)
-async def toolbox_page() -> FileResponse:
+async def toolbox_page(request: Request) -> Response:
     """Serve the original toolbox landing page."""
-    index_path = STATIC_DIR / "index.html"
-    return FileResponse(index_path)
+    return page_response(request, "index.html")
 
 
 @app.get("/ip-intel", include_in_schema=False)
-async def ip_intel_page() -> FileResponse:
+async def ip_intel_page(request: Request) -> Response:
     """Serve the IP Intelligence page."""
-    page_path = STATIC_DIR / "ip_intel.html"
-    return FileResponse(page_path)
+    return page_response(request, "ip_intel.html")
 
 
 @app.get("/webrtc", include_in_schema=False)
-async def webrtc_page() -> FileResponse:
+async def webrtc_page(request: Request) -> Response:
     """Serve the WebRTC leak test page."""
-    page_path = STATIC_DIR / "webrtc.html"
-    return FileResponse(page_path)
+    return page_response(request, "webrtc.html")
 
 
-async def get_public_ipv4() -> Optional[str]:
-    """Resolve the caller's IPv4 address using api.ipify.org."""
+# ipify reports the server's own egress address, which is the same for every
+# caller, so a lookup is shared by all requests for a few seconds.  Storing the
+# task (rather than its result) also lets concurrent callers await one request.
+IPIFY_TTL = 5.0
+_IPIFY_TASKS: dict[str, tuple[float, asyncio.Task]] = {}
+
+
+async def query_ipify(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    """Ask an ipify endpoint for the public address it sees."""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get("https://api.ipify.org", params={"format": "json"})
-            resp.raise_for_status()
-            data = resp.json()
-            return data.get("ip")
+        resp = await client.get(url, params={"format": "json"})
+        resp.raise_for_status()
+        data = orjson.loads(resp.content)
+        return data.get("ip")
     except Exception:
         return None
 
 
-async def get_public_ipv6() -> Optional[str]:
+async def coalesced_ipify(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    """Return the ipify answer for `url`, reusing an in-flight or recent lookup."""
+    now = asyncio.get_running_loop().time()
+    entry = _IPIFY_TASKS.get(url)
+    if entry is None or now - entry[0] >= IPIFY_TTL:
+        entry = (now, asyncio.create_task(query_ipify(client, url)))
+        _IPIFY_TASKS[url] = entry
+    # Shield the shared task so one cancelled caller does not cancel it for all.
+    return await asyncio.shield(entry[1])
+
+
+async def get_public_ipv4(client: httpx.AsyncClient) -> Optional[str]:
+    """Resolve the caller's IPv4 address using api.ipify.org."""
+    return await coalesced_ipify(client, "https://api.ipify.org")
+
+
+async def get_public_ipv6(client: httpx.AsyncClient) -> Optional[str]:
     """Resolve the caller's IPv6 address using api64.ipify.org."""
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get("https://api64.ipify.org", params={"format": "json"})
-            resp.raise_for_status()
-            data = resp.json()
-            return data.get("ip")
-    except Exception:
-        return None
+    return await coalesced_ipify(client, "https://api64.ipify.org")
+
+
+def set_cache_header(response: Response, hit: bool) -> None:
+    """Report whether provider results came from the in-process cache."""
+    response.headers["X-Cache"] = "hit" if hit else "miss"
 
 
 @app.get("/api/local_ip", response_model=LocalIPResponse)
-async def local_ip_endpoint() -> LocalIPResponse:
+async def local_ip_endpoint(request: Request, response: Response) -> LocalIPResponse:
     """Endpoint for obtaining local IP information and geolocation from multiple providers."""
-    ipv4, ipv6 = await asyncio.gather(get_public_ipv4(), get_public_ipv6())
-    providers: list[ProviderResult] = await fetch_providers()
+    client: httpx.AsyncClient = request.app.state.client
+    ipv4, ipv6 = await asyncio.gather(get_public_ipv4(client), get_public_ipv6(client))
+    providers, hit = await fetch_providers_cached(client)
+    set_cache_header(response, hit)
     return LocalIPResponse(ipv4=ipv4, ipv6=ipv6, providers=providers)
 
 
 @app.post("/api/ip_intel", response_model=IPIntelResponse)
-async def ip_intel_endpoint(payload: IPIntelRequest) -> IPIntelResponse:
+async def ip_intel_endpoint(request: Request, response: Response, payload: IPIntelRequest) -> IPIntelResponse:
     """Endpoint for IP intelligence.  Accepts an optional IP address in the request body."""
+    client: httpx.AsyncClient = request.app.state.client
     ip = payload.ip
     # If IP is not provided, attempt to infer via ipify (IPv4) first; fallback to providers.
     if not ip:
-        ip = await get_public_ipv4() or await get_public_ipv6() or ""
-    providers: list[ProviderResult] = await fetch_providers(ip)
+        ip = await get_public_ipv4(client) or await get_public_ipv6(client) or ""
+    providers, hit = await fetch_providers_cached(client, ip)
+    set_cache_header(response, hit)
     return IPIntelResponse(ip=ip or "", providers=providers)
 
 
 @app.get("/api/ip_intel")
-async def ip_intel_endpoint_get(ip: Optional[str] = None) -> IPIntelResponse:
+async def ip_intel_endpoint_get(
+    request: Request, response: Response, ip: Optional[str] = Query(None, max_length=MAX_IP_LENGTH)
+) -> IPIntelResponse:
     """GET variant of IP intelligence endpoint for convenience in browser queries."""
-    return await ip_intel_endpoint(IPIntelRequest(ip=ip))
+    return await ip_intel_endpoint(request, response, IPIntelRequest(ip=ip))
+
+
+# Proxy/CDN headers echoed back by /api/request_meta.
+_HEADERS_OF_INTEREST = (
+    "x-forwarded-for",
+    "x-real-ip",
+    "cf-connecting-ip",
+    "cf-ipcountry",
+    "x-forwarded-proto",
+    "via",
+    "user-agent",
+)
 
 
 @app.get("/api/request_meta", response_model=RequestMetaResponse)
 async def request_meta_endpoint(request: Request) -> RequestMetaResponse:
     """Expose request metadata useful for debugging proxy/CDN deployments."""
-    headers_of_interest = [
-        "x-forwarded-for",
-        "x-real-ip",
-        "cf-connecting-ip",
-        "cf-ipcountry",
-        "x-forwarded-proto",
-        "via",
-        "user-agent",
-    ]
-    header_map = {k: request.headers.get(k) for k in headers_of_interest if request.headers.get(k)}
+    header_map = {k: v for k in _HEADERS_OF_INTEREST if (v := request.headers.get(k)) is not None}
     return RequestMetaResponse(
         client_ip=request.client.host if request.client else None,
         headers=header_map,
@@ -141,3 +246,16 @@ async def request_meta_endpoint(request: Request) -> RequestMetaResponse:
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc: Exception) -> JSONResponse:
     return JSONResponse(status_code=404, content={"detail": "Not Found"})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop" if uvloop else "asyncio",
+        http="httptools",
+        workers=os.cpu_count(),
+    )
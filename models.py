@@ -1,15 +1,23 @@
 """Pydantic models defining request and response schemas for the IP Network toolbox.
 
 These models provide type safety and clear documentation for the FastAPI endpoints.
+All models are immutable, which lets provider results be shared safely between
+cached responses.  Provider fetchers build `GeoInfo`/`ProviderResult` through
+`model_construct`, so the field mappings there must already produce the right types.
 """
 
 from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+# Longest textual IP address: an IPv4-mapped IPv6 address.
+MAX_IP_LENGTH = 45
 
 
 class GeoInfo(BaseModel):
     """Geolocation and network information for an IP address."""
 
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     ip: str = Field(..., description="The IP address queried")
     country: Optional[str] = Field(None, description="Country code or name")
     region: Optional[str] = Field(None, description="Region or state name")
@@ -24,6 +32,8 @@ class GeoInfo(BaseModel):
 class ProviderResult(BaseModel):
     """Result returned by a single IP data provider."""
 
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     provider: str = Field(..., description="Name of the data provider (e.g. ipapi, ipinfo)")
     ok: bool = Field(..., description="Whether the provider responded successfully")
     data: Optional[GeoInfo] = Field(None, description="Parsed geolocation/network data if successful")
@@ -33,6 +43,8 @@ class ProviderResult(BaseModel):
 class LocalIPResponse(BaseModel):
     """Response for the /api/local_ip endpoint."""
 
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     ipv4: Optional[str] = Field(None, description="Detected IPv4 address")
     ipv6: Optional[str] = Field(None, description="Detected IPv6 address")
     providers: List[ProviderResult] = Field(
@@ -43,12 +55,17 @@ class LocalIPResponse(BaseModel):
 class IPIntelRequest(BaseModel):
     """Request payload for the /api/ip_intel endpoint."""
 
+    # Unknown keys and over-long addresses are rejected during request validation.
+    model_config = ConfigDict(frozen=True, extra="forbid", str_max_length=MAX_IP_LENGTH)
+
     ip: Optional[str] = Field(None, description="IP address to query; if omitted, query the caller's IP")
 
 
 class IPIntelResponse(BaseModel):
     """Response for the /api/ip_intel endpoint."""
 
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     ip: str = Field(..., description="The IP address that was resolved (caller if none provided)")
     providers: List[ProviderResult] = Field(
         ..., description="Results from multiple providers with geolocation and network data"
@@ -58,5 +75,7 @@ class IPIntelResponse(BaseModel):
 class RequestMetaResponse(BaseModel):
     """Response for /api/request_meta containing proxy-related request metadata."""
 
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     client_ip: Optional[str] = Field(None, description="Observed client IP from the socket")
     headers: Dict[str, str] = Field(default_factory=dict, description="Selected request headers")